@@ -6,62 +6,127 @@ Authors: John (@Magicks52), David (@DavidTimothyNam), Arya (@AryaGill)
 Tested: Python 3.10.4 on Kali Linux and Python 3.9.5 on Ubuntu
 """
 
+import asyncio
 import base64
 import bs4
 import codecs
+import concurrent.futures
+import functools
+import httpx
+import itertools
+import mmap
 import os
 import re
 import requests
+import threading
 
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin
 from pprint import pprint
 
+# hyperscan is optional; without it, flag parsing falls back to the
+# three separate 're' scans
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# compiled once at import; DOTALL lets /* */ comments span lines and the
+# [^\n]* character class finds // comments on every line without the
+# backtracking that the old lazy end-of-string pattern caused
+_C_COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+_LINE_COMMENT_PATTERN = re.compile(r"//[^\n]*")
+_HTML_COMMENT_PATTERN = re.compile(r"<!--(.*?)-->", re.DOTALL)
+
+# robots.txt directives and comment lines, matched in one C-level pass
+# per pattern instead of splitting and comparing every line in Python;
+# [ \t]* keeps the value on the directive's own line so an empty
+# directive like 'Disallow:' is ignored rather than swallowing the next
+# line
+_ROBOTS_FIELD_PATTERN = re.compile(
+    r"^(User-agent|Disallow|Allow|Sitemap):[ \t]*(\S+)", re.MULTILINE
+)
+_ROBOTS_COMMENT_PATTERN = re.compile(r"^[^\n]*#[^\n]*", re.MULTILINE)
+
 
 def extract_comments(source_code: str) -> list:
     """Accepts source code of a website as a string and parses comments."""
 
     all_comments = []
-    # set up html to be parsed, find html comments
-    soup = bs4.BeautifulSoup(source_code, "html.parser")
-    # get html comments
-    all_comments += soup.findAll(text=lambda text: isinstance(text, bs4.Comment))
+    # get html comments; the group keeps only the comment body, the same
+    # text bs4's Comment nodes carried, without building a parse tree
+    all_comments += _HTML_COMMENT_PATTERN.findall(source_code)
     # get php, css, js, multi-line comments /* */
-    all_comments += re.findall(r"/\*.+?\*/", source_code)
+    all_comments += _C_COMMENT_PATTERN.findall(source_code)
     # get single-line javascript comments
-    all_comments += re.findall(r"//.+?$", source_code)
+    all_comments += _LINE_COMMENT_PATTERN.findall(source_code)
     return all_comments
 
 
+def _read_file_text(file_path: str) -> str:
+    """Read the file at the specified path, ignoring bad utf-8 characters.
+
+    The file is mapped with mmap so the kernel pages it in on demand
+    instead of copying the raw bytes into a Python object first."""
+
+    with open(file_path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # str() decodes straight from the mapped buffer, so the
+                # decoded text is the only full copy made
+                return str(mapped, "utf-8", "ignore")
+        except ValueError:
+            # empty files can't be mapped
+            return f.read().decode("utf-8", "ignore")
+
+
 def extract_comments_from_file(file_path: str) -> list:
     """Return a list of all comments in the file at the specified path."""
 
-    with open(file_path, "rb") as f:
-        comments = extract_comments(f.read().decode("utf-8", "ignore"))
-    return comments
+    return extract_comments(_read_file_text(file_path))
+
+
+def _is_absolute_url(file_path: str) -> bool:
+    """Return True if the path is already a full or protocol-relative URL."""
+
+    return file_path.startswith(("http://", "https://", "//"))
+
+
+def iter_files_in_dir(path_to_directory: str):
+    """Accepts a path to a directory and yields the filepath of every file
+    in the directory as it is found."""
+
+    # a missing directory yields nothing, matching how os.walk behaved
+    # before a mirror has been made
+    try:
+        entries = os.scandir(path_to_directory)
+    except FileNotFoundError:
+        return
+    # os.scandir caches the entry type from the dirent, so no extra
+    # stat call is needed per file
+    with entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                yield entry.path
+            elif entry.is_dir(follow_symlinks=False):
+                yield from iter_files_in_dir(entry.path)
 
 
 def get_files_in_dir(path_to_directory: str) -> list:
     """Accepts a path to a directory and returns a list of filepaths of every
     file in the directory."""
 
-    list_of_files = []
-    for root, dirs, files in os.walk(path_to_directory):
-        for file in files:
-            # append relative filepaths
-            list_of_files.append(os.path.join(root, file))
-    return list_of_files
+    return list(iter_files_in_dir(path_to_directory))
 
 
 def make_regex_string(crib: str) -> str:
     """Accepts a CTF flag crib and formats it."""
 
     crib = crib.strip("{")
-    regex_string = ""
-    for character in crib:
-        regex_string += character
-        regex_string += ".{0,2}"
     # regex string will match flag with any padding of less than 2 characters
-    # in between each flag character (above)
+    # in between each flag character; escaping each character keeps regex
+    # metacharacters in a crib from being treated as syntax
+    regex_string = ".{0,2}".join(re.escape(character) for character in crib)
     regex_string += r"\{.*?\}"
     return regex_string
 
@@ -73,7 +138,8 @@ def rot13_decode(enc: str) -> str:
 
 def base64_decode(enc: str) -> str:
     """Return decoded base64 string."""
-    return base64.b64decode(bytes(enc, "utf-8")).decode()
+    # b64decode takes ascii str directly; no need to round-trip bytes
+    return base64.b64decode(enc).decode()
 
 
 def format_flags(plaintext_flags: list, rot13_flags: list, base64_flags: list) -> dict:
@@ -87,33 +153,116 @@ def format_flags(plaintext_flags: list, rot13_flags: list, base64_flags: list) -
     return flags
 
 
-def parse_for_flag(crib: str, text: str) -> list:
-    """Accepts a CTF flag crib and uses it to find plaintext, rot13 encoded,
-    and base64 encoded flags in given text."""
+@functools.lru_cache(maxsize=32)
+def _build_flag_patterns(crib: str) -> tuple:
+    """Compile and cache the plaintext, rot13, and base64 regex objects for
+    the given crib so repeated parses don't recompile them."""
 
     regex_string = make_regex_string(crib)
     # make regex objects from patterns for plaintext, rot13, and base64
     plaintext_pattern = re.compile(regex_string)
     rot13_pattern = re.compile(codecs.encode(regex_string, "rot-13"))
-    base64_first_three = base64.b64encode(bytes(crib, "utf-8")).decode()
-    base64_pattern = re.compile(
-        f"{base64_first_three[0:3]}[+\\\\A-Za-z0-9]+[=]{{0,2}}\s"
+    # the first three base64 characters of the crib are enough of a
+    # prefix to anchor the pattern; encode once and slice the bytes
+    base64_prefix = base64.b64encode(crib.encode("utf-8"))[:3].decode("ascii")
+    base64_pattern = re.compile(base64_prefix + r"[+\\A-Za-z0-9]+[=]{0,2}\s")
+    return (plaintext_pattern, rot13_pattern, base64_pattern)
+
+
+@functools.lru_cache(maxsize=32)
+def _build_hyperscan_database(crib: str):
+    """Compile the plaintext, rot13, and base64 patterns for the given crib
+    into a single hyperscan database that scans every byte once."""
+
+    plaintext_pattern, rot13_pattern, base64_pattern = _build_flag_patterns(crib)
+    database = hyperscan.Database()
+    database.compile(
+        expressions=[
+            plaintext_pattern.pattern.encode(),
+            rot13_pattern.pattern.encode(),
+            base64_pattern.pattern.encode(),
+        ],
+        ids=[0, 1, 2],
+        elements=3,
+        flags=[hyperscan.HS_FLAG_SOM_LEFTMOST] * 3,
     )
-    # Get list of possible flags
-    plaintext_flags = plaintext_pattern.findall(text)
-    rot13_flags = rot13_pattern.findall(text)
-    base64_flags = base64_pattern.findall(text)
+    return database
+
+
+_hyperscan_locals = threading.local()
+
+
+def _hyperscan_scratch(database):
+    """Return this thread's scratch space for the database, allocating one
+    on first use; the scratch built into Database.scan is shared and not
+    safe for the concurrent scans the thread pools run."""
+
+    scratches = getattr(_hyperscan_locals, "scratches", None)
+    if scratches is None:
+        scratches = _hyperscan_locals.scratches = {}
+    scratch = scratches.get(database)
+    if scratch is None:
+        scratch = scratches[database] = hyperscan.Scratch(database)
+    return scratch
+
+
+def _hyperscan_for_flag(crib: str, text: str) -> tuple:
+    """Scan text once with hyperscan to learn which patterns hit at all,
+    then run only those 're' patterns to extract the actual flags."""
+
+    data = text.encode("utf-8", "ignore")
+    # hyperscan attributes every match end to the leftmost viable start,
+    # so its reports can't reconstruct what findall returns when a file
+    # holds several overlapping flags; use it purely as a single-pass
+    # prefilter and leave the (rare) extraction to the 're' patterns
+    hit_ids = set()
+
+    def on_match(pattern_id, start, end, flags, context=None):
+        hit_ids.add(pattern_id)
+
+    database = _build_hyperscan_database(crib)
+    database.scan(
+        data, match_event_handler=on_match, scratch=_hyperscan_scratch(database)
+    )
+    patterns = _build_flag_patterns(crib)
+    return tuple(
+        pattern.findall(text) if pattern_id in hit_ids else []
+        for pattern_id, pattern in enumerate(patterns)
+    )
+
+
+def parse_for_flag(crib: str, text: str) -> dict:
+    """Accepts a CTF flag crib and uses it to find plaintext, rot13 encoded,
+    and base64 encoded flags in given text."""
+
+    if hyperscan is not None:
+        # single pass over the text across all three patterns
+        plaintext_flags, rot13_flags, base64_flags = _hyperscan_for_flag(
+            crib, text
+        )
+    else:
+        # compiled once per crib, then reused across every file parsed
+        plaintext_pattern, rot13_pattern, base64_pattern = _build_flag_patterns(
+            crib
+        )
+        # Get list of possible flags
+        plaintext_flags = plaintext_pattern.findall(text)
+        rot13_flags = rot13_pattern.findall(text)
+        # most files contain no base64 flag at all, and every match must
+        # start with the literal three-character prefix, so a C-level
+        # substring scan decides whether the regex needs to run
+        if base64_pattern.pattern[:3] in text:
+            base64_flags = base64_pattern.findall(text)
+        else:
+            base64_flags = []
     # append decoded flag with description of encoding to possible flags
     return format_flags(plaintext_flags, rot13_flags, base64_flags)
 
 
-def parse_file_for_flag(crib: str, file_path: str) -> list:
+def parse_file_for_flag(crib: str, file_path: str) -> dict:
     """Parses file for crib."""
 
-    with open(file_path, "rb") as f:
-        # ignore bad utf-8 characters
-        flags = parse_for_flag(crib, f.read().decode("utf-8", "ignore"))
-    return flags
+    return parse_for_flag(crib, _read_file_text(file_path))
 
 
 class Wizard:
@@ -122,13 +271,35 @@ class Wizard:
     def __init__(self, url: str, directory: str = "/tmp/") -> None:
         self.url = url
         self.webwizard_dir = os.path.join(directory, "webwizard_output/")
+        # one session for every request so the underlying connection
+        # pool is reused instead of handshaking per call
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # parsed robots.txt is cached after the first crawl
+        self._robots_cache = None
+        # per-file comment results, keyed by path with the file's
+        # (mtime, size) recorded to invalidate stale entries
+        self._comment_cache = {}
+
+    def check_robots(self) -> bool:
+        """Returns True if the website serves a robots.txt page. Uses a
+        HEAD request so the body isn't downloaded just for the check."""
+
+        robots_link = urljoin(self.url, "robots.txt")
+        r = self.session.head(robots_link, allow_redirects=True)
+        return r.status_code == 200
 
     def crawl_robots(self) -> dict:
         """Accesses robots.txt and if the page exists, returns a dictionary
         with organized information."""
 
+        # reuse the parsed result so repeat calls don't re-download
+        if self._robots_cache is not None:
+            return self._robots_cache
         robots_link = urljoin(self.url, "robots.txt")
-        r = requests.get(robots_link)
+        r = self.session.get(robots_link)
         # if the page actualy exists
         if r.status_code == 200:
             robots_info = {
@@ -139,46 +310,51 @@ class Wizard:
                 "sitemap": [],
             }
             # organize the information in robots.txt
-            robots = r.content.decode().split("\n")
-            for line in robots:
-                if "#" in line:
-                    robots_info["comments"].append(line)
-                else:
-                    entry = line.split(" ")
-                    # ignore empty entries
-                    if len(entry) != 1:
-                        if entry[0] == "User-agent:":
-                            robots_info["user-agent"].append(entry[1])
-                        elif entry[0] == "Disallow:":
-                            robots_info["disallow"].append(entry[1])
-                        elif entry[0] == "Allow:":
-                            robots_info["allow"].append(entry[1])
-                        elif entry[0] == "Sitemap:":
-                            robots_info["sitemap"].append(entry[1])
+            robots = r.content.decode()
+            robots_info["comments"] = _ROBOTS_COMMENT_PATTERN.findall(robots)
+            # each directive name lowercases to its robots_info key
+            for field, value in _ROBOTS_FIELD_PATTERN.findall(robots):
+                robots_info[field.lower()].append(value)
         # if the page doesn't exist
         else:
             # return empty dict
             robots_info = {}
+        self._robots_cache = robots_info
         return robots_info
 
+    def _cached_extract_comments(self, file_path: str) -> list:
+        """Returns comments for the file, reusing the cached result if the
+        file's mtime and size haven't changed since the last scan."""
+
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._comment_cache.get(file_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        comments = extract_comments_from_file(file_path)
+        self._comment_cache[file_path] = (key, comments)
+        return comments
+
     def get_comments(self) -> list:
         """Returns a list of all comments from mirrored website."""
 
-        # get list of filepaths for each file in the folder
-        subfile_list = get_files_in_dir(self.webwizard_dir)
-        # parse all subfiles for comments
-        comments = []
-        for subfile in subfile_list:
-            comments += extract_comments_from_file(subfile)
+        # stream filepaths from the folder as they are discovered
+        subfile_list = iter_files_in_dir(self.webwizard_dir)
+        # parse subfiles for comments in parallel; the work is mostly
+        # file reads and C-level parsing, so threads overlap well
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 4)
+        ) as executor:
+            results = executor.map(self._cached_extract_comments, subfile_list)
+            comments = list(itertools.chain.from_iterable(results))
         return comments
 
     def get_cookies(self) -> dict:
         """Gets any cookies sent from the server from that URL. Returns a
         dictionary of all cookies received."""
 
-        session = requests.Session()
-        response = session.get(self.url)
-        return session.cookies.get_dict()
+        response = self.session.get(self.url)
+        return self.session.cookies.get_dict()
 
     def get_all_cookies(self) -> dict:
         pass
@@ -186,97 +362,106 @@ class Wizard:
     def get_remote_files(self, link: str) -> list:
         """Parse file at the specified link for other remote files, return a
         list of URLs to remote files."""
-        css_files = []
-        image_files = []
-        script_files = []
-        all_files = []
+        # one set gives O(1) dedup across every kind of referenced file
+        all_files = set()
         # make a GET request to the website url, append \n
         # so properly ends with a newline
-        r = requests.get(link)
+        r = self.session.get(link)
         # set up HTML to be parsed for source files
-        soup = bs4.BeautifulSoup(r.text, "html.parser")
-        # find all '<link>' tags and use the path from the 'href'
-        # attribute to find filepaths of css files
-        for css_file in soup.find_all("link"):
-            if css_file.attrs.get("href"):
-                file_path = css_file.attrs.get("href")
-                # if 'file_path' is not a full URL yet, append the
-                # first part of the URL (the domain name)
-                if "http" not in file_path:
-                    file_path = urljoin(link, file_path)
-                    # check to see if css file was already referenced
-                    # elsewhere in the source code
-                    if file_path not in css_files:
-                        css_files.append(file_path)
-        # find all '<img>' tags and use the path from the 'src'
-        # attribute to find filepaths of image files
-        for image in soup.find_all("img"):
-            if image.attrs.get("src"):
-                file_path = image.attrs.get("src")
-                if "http" not in file_path:
-                    file_path = urljoin(link, file_path)
-                    if file_path not in image_files:
-                        image_files.append(file_path)
-        # find all '<script>' tags and use the path from the 'src'
-        # attribute to find filepaths of javascript files
-        for script in soup.find_all("script"):
-            if script.attrs.get("src"):
-                file_path = script.attrs.get("src")
-                if "http" not in file_path:
-                    file_path = urljoin(link, file_path)
-                    if file_path not in script_files:
-                        script_files.append(file_path)
+        soup = bs4.BeautifulSoup(r.text, "lxml")
+        # find every '<link>', '<img>', and '<script>' tag that references
+        # a file in a single traversal of the tree; '<link>' carries its
+        # path in 'href', the other two in 'src'
+        for tag in soup.select("link[href], img[src], script[src]"):
+            attribute = "href" if tag.name == "link" else "src"
+            file_path = tag.attrs.get(attribute)
+            # skip empty attributes like lazy-load placeholders, which
+            # urljoin would resolve to the page URL itself
+            if not file_path:
+                continue
+            # if 'file_path' is not a full URL yet, append the
+            # first part of the URL (the domain name)
+            if not _is_absolute_url(file_path):
+                file_path = urljoin(link, file_path)
+                # files already referenced elsewhere in the source code
+                # are absorbed by the set
+                all_files.add(file_path)
         # make a list of all the URLs to all the files to download
-        all_files = css_files + image_files + script_files
-        return all_files
+        return list(all_files)
 
     def mirror(self) -> None:
         """Mirrors website in output directory 'webwizard_output/'."""
 
+        asyncio.run(self._mirror_async())
+        return None
+
+    async def _mirror_async(self) -> None:
+        """Downloads all remote files concurrently over a shared
+        HTTP/2-capable connection pool and writes the mirrored tree."""
+
         # get a list of all remote files to mirror
         all_files = self.get_remote_files(self.url)
         # make 'webwizard_output/' directory
         if not os.path.isdir(self.webwizard_dir):
             os.mkdir(self.webwizard_dir)
-        # function to prepend 'webwizard_output_dir'
-        prepend_directory = lambda x: os.path.join(self.webwizard_dir, x)
-        # make directories that mirror website structure and download
-        # all files
-        for url in all_files:
-            path = url[len(self.url) :].split("/")
-            if len(path) > 1:
-                file_name = path[-1]
-                # everything in the URL up to the filename
-                local_path = prepend_directory("/".join(path[:-1]))
-                # make directories if they don't exist
-                if not os.path.isdir(local_path):
-                    os.makedirs(local_path)
-                # download all files
-                page = requests.get(url)
-                with open(f"{local_path}/{file_name}", "wb") as source_file:
-                    source_file.write(page.content)
-            else:
-                # if the file being requested is at the root of the website,
-                # write it directly to 'webwizard_output/'
-                page = requests.get(url)
-                with open(prepend_directory(path[0]), "wb") as source_file:
-                    source_file.write(page.content)
-        # download 'index.html'
-        with open(prepend_directory("index.html"), "wb") as index_file:
-            # make a GET request to the website url, append \n
-            # so it properly ends with a newline
-            r = requests.get(self.url)
-            source_code = r.content + b"\n"
-            index_file.write(source_code)
+        limits = httpx.Limits(max_connections=20)
+        async with httpx.AsyncClient(http2=True, limits=limits) as client:
+            # stream every file at once instead of serializing one
+            # round trip per file; most assets share a handful of
+            # directories, so remember which ones were already created
+            # to skip the stat/mkdir syscalls for repeats
+            seen_dirs = set()
+            await asyncio.gather(
+                *(self._download_asset(client, url, seen_dirs) for url in all_files)
+            )
+            # download 'index.html'
+            index_path = os.path.join(self.webwizard_dir, "index.html")
+            with open(index_path, "wb") as index_file:
+                # make a GET request to the website url, append \n
+                # so it properly ends with a newline
+                r = await client.get(self.url)
+                source_code = r.content + b"\n"
+                index_file.write(source_code)
+        return None
+
+    async def _download_asset(self, client, url: str, seen_dirs: set) -> None:
+        """Streams a single asset to its mirrored path in 64KB chunks, so
+        peak memory stays constant no matter how large the file is."""
+
+        path = url[len(self.url) :].split("/")
+        if len(path) > 1:
+            # everything in the URL up to the filename, with directories
+            # made as needed to mirror the website structure
+            local_path = os.path.join(self.webwizard_dir, "/".join(path[:-1]))
+            if local_path not in seen_dirs:
+                os.makedirs(local_path, exist_ok=True)
+                seen_dirs.add(local_path)
+            local_file = f"{local_path}/{path[-1]}"
+        else:
+            # if the file being requested is at the root of the website,
+            # write it directly to 'webwizard_output/'
+            local_file = os.path.join(self.webwizard_dir, path[0])
+        async with client.stream("GET", url) as response:
+            # a 1MB write buffer coalesces the streamed chunks so each
+            # file costs a handful of write syscalls instead of one per
+            # chunk
+            with open(local_file, "wb", buffering=1 << 20) as source_file:
+                async for chunk in response.aiter_bytes(64 * 1024):
+                    source_file.write(chunk)
         return None
 
     def parse_website_for_flag(self, crib: str) -> list:
         """Parse mirrored website for specified crib and returns list of
         possible flags."""
-        # get list of filepaths for each file in the folder
-        subfile_list = get_files_in_dir(self.webwizard_dir)
-        # parse all subfiles for flag
-        flags = []
-        for subfile in subfile_list:
-            flags.append(parse_file_for_flag(crib, subfile))
+        # stream filepaths from the folder as they are discovered
+        subfile_list = iter_files_in_dir(self.webwizard_dir)
+        # parse subfiles for the flag in parallel, same as get_comments
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 4)
+        ) as executor:
+            flags = list(
+                executor.map(
+                    functools.partial(parse_file_for_flag, crib), subfile_list
+                )
+            )
         return flags
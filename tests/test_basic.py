@@ -44,9 +44,18 @@ class TestBasic(unittest.TestCase):
         text = """
         AAA <!-- html comment --> BBB
         CCC /* css comment */ DDD
-        EEE // javascript comment"""
+        EEE // middle comment
+        FFF /* multi
+line comment */ GGG
+        HHH // javascript comment"""
         comments = webwizard.extract_comments(text)
-        correct_comments = [' html comment ', '/* css comment */', '// javascript comment']
+        correct_comments = [
+            ' html comment ',
+            '/* css comment */',
+            '// middle comment',
+            '/* multi\nline comment */',
+            '// javascript comment',
+        ]
         for correct_comment in correct_comments:
             self.assertIn(correct_comment, comments)
 